@@ -0,0 +1,78 @@
+"""
+Batch transform a directory of svgs into a single columnar table of fourier
+coefficients, spreading parsing, sampling and transforming over a process
+pool. Parsed svgs are cached on disk by load_svg_contours and every contour
+(each subpath of each <path>) gets its own coefficients, computed in closed
+form from its cubic pieces. One row per (svg, contour, freq):
+
+    python batch.py svgs/ 100 -o coeffs.npz
+
+The npz holds the columns svg (index into names), contour, freq and c,
+along with names and errors; a file that fails keeps its error message and
+no rows.
+"""
+import os
+import sys
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from fourier import FourierTransform, polynomial_cks_many
+from bezier_transform import load_svg_contours
+
+def find_svgs(directory):
+    return sorted(os.path.join(root, name)
+                  for root, dirs, files in os.walk(directory)
+                  for name in files if name.lower().endswith('.svg'))
+
+def transform_svg(path, terms, center=False):
+    # (contour, freq, c) columns for every contour of one svg
+    contours = load_svg_contours(path)
+    order = FourierTransform(None, center_on_screen=center)
+    ks = np.array([order.next_freq() for i in range(terms)], dtype=np.int32)
+    C = polynomial_cks_many([contour.pieces() for contour in contours], ks)
+    return (np.repeat(np.arange(len(contours), dtype=np.int32), len(ks)),
+            np.tile(ks, len(contours)),
+            C.ravel().astype(np.complex128))
+
+def transform_dir(directory, terms, center=False, workers=None):
+    paths = find_svgs(directory)
+    results = [None]*len(paths)
+    errors = ['']*len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(transform_svg, path, terms, center)
+                   for path in paths]
+        for i, future in enumerate(futures):
+            try:
+                results[i] = future.result()
+            except Exception as e: # a bad svg only fails itself
+                errors[i] = f'{type(e).__name__}: {e}'
+    ok = [i for i, r in enumerate(results) if r is not None]
+    column = lambda j, dtype: np.concatenate(
+            [results[i][j] for i in ok] or [np.zeros(0, dtype)])
+    table = {
+        'names': np.array(paths, dtype=str),
+        'errors': np.array(errors, dtype=str),
+        'svg': np.concatenate([np.full(len(results[i][0]), i, dtype=np.int32)
+                               for i in ok] or [np.zeros(0, np.int32)]),
+        'contour': column(0, np.int32),
+        'freq': column(1, np.int32),
+        'c': column(2, np.complex128),
+    }
+    return table
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='batch fourier transform svgs')
+    parser.add_argument('directory')
+    parser.add_argument('terms', type=int, help='coefficients per svg')
+    parser.add_argument('-o', '--out', default='coeffs.npz')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--center', action='store_true',
+                        help='skip the k=0 term, as the live view does')
+    args = parser.parse_args()
+    table = transform_dir(args.directory, args.terms, args.center, args.workers)
+    np.savez(args.out, **table)
+    for name, error in zip(table['names'], table['errors']):
+        if error:
+            print(f'{name}: {error}', file=sys.stderr)
+    print(f"{len(table['names'])} svgs, {len(table['c'])} coefficients -> "
+          f"{args.out}")
@@ -0,0 +1,164 @@
+"""
+Benchmarks for the transform, sampling and render hot paths. Runs headless
+on the shipped paths (1/2/3.path) and svgs (svgs/*.svg) and writes the
+results as JSON, so runs on different commits can be compared:
+
+    python bench.py -o before.json
+    python bench.py -o after.json --compare before.json
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import io
+import json
+import glob
+import time
+import argparse
+import platform
+import subprocess
+import contextlib
+import numpy as np
+import pygame
+import main
+from main import Game, PathBuilder
+from fourier import FourierTransform, integrate
+from bezier_transform import load_svg, get_svg_func, svg_cache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SLOTS = (1, 2, 3)
+TERMS = (10, 100, 1000)
+TRACE_RESOLUTIONS = (60, 600, 6000)
+
+def timed(fn, min_time=0.2, repeat=3):
+    # best seconds per call over repeat rounds of at least min_time each
+    best = float('inf')
+    for r in range(repeat):
+        n, elapsed = 0, 0
+        start = time.perf_counter()
+        while elapsed < min_time:
+            fn()
+            n += 1
+            elapsed = time.perf_counter() - start
+        best = min(best, elapsed/n)
+    return best
+
+def load_slot(slot):
+    pb = PathBuilder()
+    pb.load(os.path.join(HERE, str(slot)))
+    return pb
+
+def bench_transform(name, f, vf=None, poly=None):
+    out = { }
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    g = lambda t: f(t)*np.exp(-2j*np.pi*t)
+    out['integrate'] = 1/timed(lambda: integrate(g, 0, 1, FourierTransform.dt),
+                               repeat=1)
+    def scalar():
+        with quiet:
+            FourierTransform(f).next()
+    out['next'] = 1/timed(scalar, repeat=1)
+    for n in TERMS:
+        if vf is not None:
+            out[f'next_batch/{n}'] = n/timed(
+                lambda: FourierTransform(f, vf=vf).next_batch(n))
+        if poly is not None:
+            out[f'exact/{n}'] = n/timed(
+                lambda: FourierTransform(f, poly=poly).next_batch(n))
+    return {f'coeffs_per_sec/{name}/{k}': v for k, v in out.items()}
+
+def bench_sampling(name, pb):
+    out = { }
+    T = np.linspace(0, 1, 10000)
+    curve = pb.curves[0]
+    out[f'samples_per_sec/{name}/Spline.sample'] = 100/timed(
+        lambda: curve.sample(100, use_cache=False))
+    out[f'samples_per_sec/{name}/PathBuilder.get_point'] = 1000/timed(
+        lambda: [pb.get_point(t) for t in T[:1000]], repeat=1)
+    out[f'samples_per_sec/{name}/PathBuilder.get_points'] = len(T)/timed(
+        lambda: pb.get_points(T))
+    return out
+
+def bench_frames(slot):
+    # frame update and draw times on a live (headless) game
+    out = { }
+    game = main.game
+    game.path_builder.load(os.path.join(HERE, str(slot)))
+    em = game.epicycle_manager
+    for n in TERMS:
+        em.reset_fourier()
+        em.add_fourier_cycles(n)
+        em.update(1000/Game.fps)
+        em.chain.retrace(em.t - 1) # draw a whole period of trace
+        out[f'frame_sec/slot{slot}/update/{n}'] = timed(
+            lambda: em.update(1000/Game.fps))
+        out[f'frame_sec/slot{slot}/draw/{n}'] = timed(
+            lambda: em.draw(game.screen))
+    em.reset_fourier()
+    em.add_fourier_cycles(10)
+    for resolution in TRACE_RESOLUTIONS:
+        chain = em.chain
+        chain.trace_resolution = resolution
+        chain.table = None
+        chain.retrace(em.t - 1)
+        out[f'frame_sec/slot{slot}/draw_trace/{resolution}'] = timed(
+            lambda: chain.draw(game.screen))
+    out[f'frame_sec/slot{slot}/path_builder.draw'] = timed(
+        lambda: game.path_builder.draw(game.screen))
+    return out
+
+def run():
+    results = { }
+    main.game = Game()
+    main.game.epicycle_manager.coeff_cache.directory = None
+    for slot in SLOTS:
+        pb = load_slot(slot)
+        if not pb.curves:
+            continue
+        results.update(bench_transform(f'slot{slot}', pb.get_point,
+                                       pb.get_points, pb.monomials))
+        results.update(bench_sampling(f'slot{slot}', pb))
+        results.update(bench_frames(slot))
+    for filename in sorted(glob.glob(os.path.join(HERE, 'svgs', '*.svg'))):
+        name = os.path.splitext(os.path.basename(filename))[0]
+        results[f'sec/{name}/parse'] = timed(
+            lambda: (svg_cache.clear(), load_svg(filename, cache_dir=None)))
+        svg = load_svg(filename, cache_dir=None)
+        results.update(bench_transform(name, get_svg_func(filename),
+                                       svg.get_points, svg.pieces))
+    return results
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def compare(results, old):
+    # ratio > 1 is an improvement: rates went up or times went down
+    for key, value in sorted(results.items()):
+        if key not in old:
+            continue
+        ratio = value/old[key] if key.startswith(('coeffs_', 'samples_')) \
+                else old[key]/value
+        print(f'{ratio:8.2f}x  {key}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark hot paths')
+    parser.add_argument('-o', '--out', default=None, help='write JSON here')
+    parser.add_argument('--compare', default=None, help='earlier JSON run')
+    args = parser.parse_args()
+    results = run()
+    report = {'commit': commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'numpy': np.__version__,
+              'pygame': pygame.version.ver, 'results': results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+    else:
+        for key, value in sorted(results.items()):
+            print(f'{value:14.6g}  {key}')
@@ -1,37 +1,197 @@
+import os
+import math
+import hashlib
+import tempfile
 import numpy as np
 from typing import List
 
-from svg.path import parse_path
+from svg.path import parse_path, Path, Move, QuadraticBezier, CubicBezier, Arc
 from xml.dom import minidom
 
-def read_svg(svg_filepath):
+SVG_CACHE_DIR = os.path.join('assets','svgcache')
+svg_cache = { } # (abspath, mtime, size, kind) => [SvgPath, ...]
+
+def read_svg_paths(svg_filepath):
     doc = minidom.parse(svg_filepath)
     path_strings = [path.getAttribute('d') for path
                     in doc.getElementsByTagName('path')]
     doc.unlink()
-    path = parse_path(path_strings[0])
-    return path
+    return [parse_path(d) for d in path_strings]
+
+def read_svg(svg_filepath):
+    return read_svg_paths(svg_filepath)[0]
+
+def read_svg_contours(svg_filepath):
+    # every subpath of every <path>, split at its moves
+    contours = []
+    for path in read_svg_paths(svg_filepath):
+        contour = Path()
+        for segment in path:
+            if isinstance(segment, Move):
+                if len(contour):
+                    contours.append(contour)
+                contour = Path()
+            else:
+                contour.append(segment)
+        if len(contour):
+            contours.append(contour)
+    return contours
 
 def get_svg_func(svg_filepath):
     path = read_svg(svg_filepath)
     return lambda t: path.point(t).conjugate() # flip y-axis
 
+def segment_controls(segment):
+    # cubic bezier control points (complex) approximating one svg.path
+    # segment; arcs are split into pieces of at most 90 degrees
+    if isinstance(segment, CubicBezier):
+        return [(segment.start, segment.control1, segment.control2,
+                 segment.end)]
+    if isinstance(segment, QuadraticBezier): # degree elevation
+        p0, q, p3 = segment.start, segment.control, segment.end
+        return [(p0, p0 + 2*(q - p0)/3, p3 + 2*(q - p3)/3, p3)]
+    if isinstance(segment, Arc) and segment.start != segment.end and \
+       segment.radius.real and segment.radius.imag:
+        radius = segment.radius*segment.radius_scale
+        rot = complex(math.cos(math.radians(segment.rotation)),
+                      math.sin(math.radians(segment.rotation)))
+        point = lambda a: segment.center + rot*complex(
+                radius.real*math.cos(a), radius.imag*math.sin(a))
+        tangent = lambda a: rot*complex(
+                -radius.real*math.sin(a), radius.imag*math.cos(a))
+        n = max(1, math.ceil(abs(segment.delta)/90))
+        angles = np.radians(segment.theta + segment.delta*np.arange(n+1)/n)
+        h = 4/3*math.tan(math.radians(segment.delta/n)/4)
+        return [(point(a), point(a) + h*tangent(a),
+                 point(b) - h*tangent(b), point(b))
+                for a, b in zip(angles[:-1], angles[1:])]
+    # lines, closes and degenerate arcs
+    p0, p3 = segment.start, segment.end
+    return [(p0, p0 + (p3 - p0)/3, p0 + 2*(p3 - p0)/3, p3)]
+
+class SvgPath:
+    # an svg path flattened into cubic pieces, parameterized by length like
+    # svg.path: piece i covers t in bounds[i]..bounds[i+1]. y is flipped
+    def __init__(self, controls, bounds):
+        self.controls = np.asarray(controls, dtype=complex).reshape(-1,4)
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.A = self.controls.conjugate() @ Spline.B
+
+    @classmethod
+    def from_path(cls, path):
+        controls, bounds = [], [0]
+        lengths = [segment.length() for segment in path]
+        total = sum(lengths) or 1
+        t = 0
+        for segment, length in zip(path, lengths):
+            if length == 0: # moves, and anything else never reached by t
+                continue
+            pieces = segment_controls(segment)
+            for i in range(len(pieces)):
+                bounds.append(t + length/total*(i+1)/len(pieces))
+            controls.extend(pieces)
+            t += length/total
+        bounds[-1] = 1
+        return cls(controls, bounds)
+
+    def get_points(self, t):
+        # vectorized point lookup for an array of t in [0,1]
+        t = np.asarray(t, dtype=float)
+        n = len(self.A)
+        index = np.clip(np.searchsorted(self.bounds, t, side='right') - 1,
+                        0, n-1)
+        start = self.bounds[index]
+        u = (t - start)/(self.bounds[index+1] - start)
+        return np.einsum('im,mi->i', self.A[index], get_mono_ts(u))
+
+    def get_point(self, t):
+        return self.get_points([t])[0]
+
+    def pieces(self):
+        return self.A, self.bounds
+
+def load_svg(svg_filepath, cache_dir=SVG_CACHE_DIR):
+    # read_svg as an SvgPath
+    return cached_svg(svg_filepath, 'path', lambda: [read_svg(svg_filepath)],
+                      cache_dir)[0]
+
+def load_svg_contours(svg_filepath, cache_dir=SVG_CACHE_DIR):
+    # read_svg_contours as a list of SvgPaths
+    return cached_svg(svg_filepath, 'contours',
+                      lambda: read_svg_contours(svg_filepath), cache_dir)
+
+def cached_svg(svg_filepath, kind, read, cache_dir=SVG_CACHE_DIR):
+    # SvgPaths of the svg.path Paths from read(), cached in memory by mtime
+    # and on disk by a hash of the file's bytes, so repeated loads skip
+    # parsing
+    stat = os.stat(svg_filepath)
+    key = (os.path.abspath(svg_filepath), stat.st_mtime_ns, stat.st_size, kind)
+    if key in svg_cache:
+        return svg_cache[key]
+    with open(svg_filepath, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    filename = (os.path.join(cache_dir, f'{digest}-{kind}.npz')
+                if cache_dir else None)
+    if filename and os.path.exists(filename):
+        with np.load(filename) as data:
+            counts = data['counts']
+            svgs = [SvgPath(controls, bounds) for controls, bounds in
+                    zip(np.split(data['controls'], np.cumsum(counts)[:-1]),
+                        np.split(data['bounds'], np.cumsum(counts+1)[:-1]))]
+    else:
+        svgs = [SvgPath.from_path(path) for path in read()]
+        if filename:
+            # written aside and renamed into place, so processes loading
+            # the same svg never read a half written file
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp',
+                                             delete=False) as f:
+                np.savez(f,
+                         controls=np.concatenate([svg.controls
+                                                  for svg in svgs]),
+                         bounds=np.concatenate([svg.bounds for svg in svgs]),
+                         counts=[len(svg.controls) for svg in svgs])
+            os.replace(f.name, filename)
+    svg_cache[key] = svgs
+    return svgs
+
 def control_point_mat(points):
     return np.array(points).T
 
+def geometry_key(splines):
+    # hash of the control point matrices, identifying the shape of a path
+    h = hashlib.sha1()
+    for spline in splines:
+        h.update(np.ascontiguousarray(spline.controls, dtype=float).tobytes())
+    return h.hexdigest()
+
 def get_Ts(n=100, max_t=1):
-    t = np.linspace(0,max_t,n)
-    T = []
-    for i in range(n):
-        ti = t[i]
-        T.append((1,ti,ti*ti,ti**3))
-    return np.array(T).T#.reshape(4,n)
+    return get_mono_ts(np.linspace(0,max_t,n))
+
+sample_tables = { } # n => read-only (monomial, bernstein) 4 x n matrices
+
+def sample_table(n):
+    # basis matrices at n evenly spaced t in [0,1], shared by every spline:
+    # points = C @ monomial = controls @ bernstein
+    if n not in sample_tables:
+        T = get_Ts(n)
+        BT = Spline.B @ T
+        T.flags.writeable = BT.flags.writeable = False
+        sample_tables[n] = (T, BT)
+    return sample_tables[n]
 
 def get_mono_t(t):
     return np.array((1, t, t*t, t**3))
 
+def get_mono_ts(t):
+    # 4 x n monomial matrix for an array of t values
+    t = np.asarray(t, dtype=float)
+    return np.vstack((np.ones_like(t), t, t*t, t*t*t))
+
 class Spline:
     B = np.array(((1,-3,3,-1),(0,3,-6,3),(0,0,3,-3),(0,0,0,1))) # bernstein basis
+    arc = None # (t, cumulative length) table, see arc_table
+    dirty = True # controls changed since the last sample()
     def __init__(self, control_points: List[float]):
         self.controls = control_point_mat(control_points)
         self.C = self.controls @ self.B
@@ -41,6 +201,8 @@ class Spline:
     def update_controls(self, index, point):
         self.controls.T[index] = point
         self.C = self.controls @ self.B
+        self.arc = None
+        self.dirty = True
 
     def rescale_time(self, factor):
         self.max_t = factor
@@ -49,12 +211,50 @@ class Spline:
         t = t/self.max_t
         return self.C @ get_mono_t(t)
 
-    def sample(self, n=100, use_cache=True):
-        if use_cache and self.cached:
+    def get_points(self, t):
+        # vectorized get_point: returns a 2 x n array for an array of t
+        t = np.asarray(t, dtype=float)/self.max_t
+        return self.C @ get_mono_ts(t)
+
+    def arc_table(self, n=64):
+        # cumulative arc length at n+1 evenly spaced t, as a polyline
+        if self.arc is None or len(self.arc[0]) != n+1:
+            t = np.linspace(0, self.max_t, n+1)
+            steps = np.linalg.norm(np.diff(self.get_points(t), axis=1), axis=0)
+            self.arc = (t, np.concatenate(([0], np.cumsum(steps))))
+        return self.arc
+
+    def length(self):
+        return self.arc_table()[1][-1]
+
+    def arc_to_t(self, s):
+        # local t at arc length s along the curve (binary search + lerp)
+        t, cum = self.arc_table()
+        return np.interp(s, cum, t)
+
+    def segments(self, tolerance=0.25, max_n=100):
+        # polyline segments keeping the curve within tolerance of its chord
+        # (wang's formula: bounded by the control polygon's second
+        # differences, so flat splines get few and tight bends many)
+        d = np.diff(self.controls, n=2, axis=1)
+        m = np.sqrt((d*d).sum(axis=0).max())
+        return int(min(max_n, max(1, math.ceil(math.sqrt(0.75*m/tolerance)))))
+
+    def sample(self, n=None, use_cache=True, tolerance=0.25):
+        # (n, 2) points along the curve, recomputed only when the controls
+        # changed; written into the same buffer each time. n defaults to
+        # enough points for tolerance (in pixels), see segments
+        if use_cache and not self.dirty and self.cached is not None \
+           and (n is None or len(self.cached) == n):
             return self.cached
-        self.T = get_Ts(n, max_t=1)
-        #self.C = self.controls @ self.B
-        self.cached = list(zip((self.C @ self.T).T))
+        if n is None:
+            n = self.segments(tolerance) + 1
+        buffer = getattr(self, 'buffer', None)
+        if buffer is None or buffer.shape[1] != n:
+            buffer = self.buffer = np.empty((2, n))
+        np.matmul(self.controls, sample_table(n)[1], out=buffer)
+        self.cached = buffer.T
+        self.dirty = False
         return self.cached
 
 #-- point at t: [Control Points][Bernstein Basis][T vector in monomial basis]
@@ -0,0 +1,89 @@
+"""
+Columnar file format for fourier coefficients. A 16 byte header is followed
+by any number of chunks, so a spectrum can be written as it is computed and
+appended to later; each chunk stores its columns back to back, and reading
+memory-maps the file, so the columns of a chunk are views of it:
+
+    header  magic b'EPCF', version, flags, reserved
+    chunk   uint64  count, then these columns of count rows each
+      freq  int32       (padded to 8 bytes)
+      c     complex128  the coefficient
+      r     float64     |c|
+      phase float64     arg c
+"""
+import os
+import numpy as np
+
+MAGIC = b'EPCF'
+VERSION = 1
+HEADER = np.dtype([('magic','S4'), ('version','<u2'), ('flags','<u2'),
+                   ('reserved','<u8')])
+COUNT = np.dtype('<u8')
+COLUMNS = [('freq', '<i4'), ('c', '<c16'), ('r', '<f8'), ('phase', '<f8')]
+
+def padded(nbytes):
+    return -(-nbytes//8)*8
+
+def columns(freq, c):
+    # the stored columns of coefficients c at frequencies freq
+    c = np.asarray(c, dtype=np.complex128)
+    return {'freq': np.asarray(freq, dtype=np.int32), 'c': c,
+            'r': np.abs(c), 'phase': np.angle(c)}
+
+def create(filename):
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    with open(filename, 'wb') as f:
+        header.tofile(f)
+
+def append(filename, freq, c):
+    # add one chunk, creating the file if needed
+    if not os.path.exists(filename):
+        create(filename)
+    arrays = columns(freq, c)
+    if len(arrays['freq']) != len(arrays['c']):
+        raise ValueError('freq and c differ in length')
+    with open(filename, 'ab') as f:
+        np.array([len(arrays['c'])], dtype=COUNT).tofile(f)
+        for name, dtype in COLUMNS:
+            data = np.ascontiguousarray(arrays[name], dtype=dtype).tobytes()
+            f.write(data + bytes(padded(len(data)) - len(data)))
+
+def write(filename, freq, c):
+    create(filename)
+    append(filename, freq, c)
+
+def chunks(filename):
+    # yields each chunk as a dict of read-only columns mapped from the file
+    if os.path.getsize(filename) < HEADER.itemsize:
+        raise ValueError(f'{filename}: truncated header')
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    header = data[:HEADER.itemsize].view(HEADER)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError(f'{filename}: not a coefficient file')
+    if header['version'] != VERSION:
+        raise ValueError(f'{filename}: unsupported version {header["version"]}')
+    offset = HEADER.itemsize
+    while offset < len(data):
+        if offset + COUNT.itemsize > len(data):
+            raise ValueError(f'{filename}: truncated chunk')
+        n = int(data[offset:offset+COUNT.itemsize].view(COUNT)[0])
+        offset += COUNT.itemsize
+        chunk = { }
+        for name, dtype in COLUMNS:
+            size = np.dtype(dtype).itemsize*n
+            if offset + size > len(data):
+                raise ValueError(f'{filename}: truncated {name}')
+            chunk[name] = data[offset:offset+size].view(dtype)
+            offset += padded(size)
+        yield chunk
+
+def read(filename):
+    # every chunk's columns joined; a single chunk is not copied
+    parts = list(chunks(filename))
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]
+                                 or [np.zeros(0, dtype)])
+            for name, dtype in COLUMNS}
@@ -1,6 +1,13 @@
+import os
 import math
+import queue
+import hashlib
+import threading
 import numpy as np
 from functools import partial
+from collections import OrderedDict
+import coeffile
+import sharedarrays
 
 class FourierTransformOld:
     def __init__(self, f, n=50, samps=1000, t0=0, t1=1):
@@ -68,41 +75,377 @@ def b(t,k,f,L=2*math.pi):
 
 class FourierCoeff:
     def __init__(self, freq, c):
-        self.c = c
         self.freq = freq
+        self.set(c)
+
+    def set(self, c):
+        self.c = c
         self.r = np.linalg.norm(c) 
         self.phase = np.arctan2(c.imag, c.real)
         
+class CoeffCache:
+    # LRU of coefficients per path; each entry maps freq -> c so asking for
+    # more terms than are cached only computes the missing ones
+    def __init__(self, maxsize=32, directory=None):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+        self.directory = directory # optional on-disk layer
+
+    def filename(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        entry = self.load(key)
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def update(self, key, cks):
+        entry = self.get(key)
+        entry.update(cks)
+        self.save(key, entry)
+
+    def load(self, key):
+        if self.directory is None or not os.path.exists(self.filename(key)):
+            return { }
+        with np.load(self.filename(key)) as data:
+            return dict(zip(data['freq'].tolist(), data['c'].tolist()))
+
+    def save(self, key, entry):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        freq = np.fromiter(entry.keys(), dtype=int, count=len(entry))
+        c = np.fromiter(entry.values(), dtype=complex, count=len(entry))
+        np.savez(self.filename(key), freq=freq, c=c)
+
+class CoeffWorker:
+    # computes coefficients on a background thread, chunk by chunk, and
+    # streams them back through a queue. cancel() drops everything
+    # submitted so far, including chunks already in flight
+    def __init__(self, chunk=10):
+        self.chunk = chunk
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def submit(self, ft, ks):
+        # the worker gets a snapshot of ft, and results carry the cache key
+        # of the geometry they were computed on
+        self.jobs.put((self.generation, ft.snapshot(), ft.cache_key(),
+                       list(ks)))
+
+    def cancel(self):
+        self.generation += 1
+
+    def work(self):
+        while True:
+            generation, ft, key, ks = self.jobs.get()
+            for i in range(0, len(ks), self.chunk):
+                if generation != self.generation:
+                    break
+                chunk = ks[i:i+self.chunk]
+                try:
+                    computed = dict(zip(chunk, ft.get_cks(chunk).tolist()))
+                except Exception as e: # reported by poll, the thread lives on
+                    computed = e
+                self.results.put((generation, key, chunk, computed))
+
+    def poll(self):
+        # (key, ks, {freq: c}) for every chunk finished since the last poll;
+        # for a chunk that failed, the exception instead of the dict
+        done = []
+        while True:
+            try:
+                generation, key, ks, computed = self.results.get_nowait()
+            except queue.Empty:
+                return done
+            if generation == self.generation:
+                done.append((key, ks, computed))
+
 class FourierTransform:
     dt = 0.001
 
-    def __init__(self, f, t0=0, t1=1, center_on_screen=False):
+    def __init__(self, f, t0=0, t1=1, center_on_screen=False, vf=None,
+                 cache=None, key=None, poly=None):
         self.coeffs = []
         self.f = f
+        self.vf = vf # optional vectorized f, mapping an array of t at once
         self.t0 = t0
         self.t1 = t1
         self.k = 0
         self.center_on_screen = center_on_screen
+        self.samples = None
+        self.spectrum = None
+        self.sampled_key = None
+        self.cache = cache # optional CoeffCache
+        self.key = key # zero-arg func hashing the current geometry of f
+        self.poly = poly # zero-arg func giving f's polynomial pieces, if any
+        self.selected = set() # freqs taken by select(), skipped by next()
+
+    def cache_key(self):
+        if self.key is None:
+            return None
+        key = f'{self.key()}:{self.t0}:{self.t1}:{self.dt}'
+        if self.poly is not None:
+            key += ':exact'
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def pieces(self):
+        # (A, bounds) when f is piecewise polynomial on [0,1]: A[i, m] is the
+        # u^m coefficient of piece i and bounds its start ts plus a final 1,
+        # or None for evenly spaced pieces. None when f is not polynomial
+        if self.poly is None or (self.t0, self.t1) != (0, 1):
+            return None
+        return self.poly()
 
     def get_ck(self, k):
+        pieces = self.pieces()
+        if pieces is not None:
+            return polynomial_cks(*pieces, [k])[0]
         g = lambda t: self.f(t)*np.exp(complex(0,-k*2*np.pi*t))
         return integrate(g, self.t0, self.t1, dt=self.dt) 
 
-    def next(self):
+    def grid(self):
+        # the t values integrate() walks
+        n = int((self.t1 - self.t0)/self.dt)
+        return np.linspace(self.t0, self.t1, n+1)
+
+    def sample(self):
+        # sample f once on the same grid integrate() walks
+        key = self.cache_key()
+        if self.samples is None or key != self.sampled_key:
+            self.spectrum = None
+            self.sampled_key = key
+            T = self.grid()
+            if self.vf is not None:
+                self.samples = np.asarray(self.vf(T), dtype=complex)
+            else:
+                self.samples = np.array([self.f(t) for t in T], dtype=complex)
+        return self.samples
+
+    def get_cks(self, ks, y=None):
+        # trapezoid rule for every k at once; agrees with get_ck.
+        # y may instead hold samples of other functions on grid(), one per
+        # column, which are then transformed column by column
+        ks = np.asarray(ks)
+        own = y is None
+        if own:
+            pieces = self.pieces()
+            if pieces is not None:
+                return polynomial_cks(*pieces, ks)
+            y = self.sample()
+        n = len(y) - 1
+        L = self.t1 - self.t0
+        dt = L/n
+        if L == 1:
+            # e^(-2pi*i*k*t) has period 1, so the endpoints fold together
+            # and the whole sum is a single fft of the samples
+            spectrum = self.spectrum if own else None
+            if spectrum is None:
+                g = np.array(y[:-1], dtype=complex)
+                g[0] = (y[0] + y[-1])/2
+                spectrum = np.fft.fft(g, axis=0)*dt
+                if own:
+                    self.spectrum = spectrum
+            shift = np.exp(-2j*np.pi*ks*self.t0)
+            return (spectrum[ks % n].T*shift).T
+        T = self.grid()
+        w = np.full(n+1, dt)
+        w[0] = w[-1] = dt/2
+        return np.exp(-2j*np.pi*np.outer(ks, T)) @ (w*y.T).T
+
+    def next_freq(self):
+        # frequencies are visited in the order 0, 1, -1, 2, -2, ...,
+        # skipping those taken by select()
         if self.k == 0 and self.center_on_screen:
             self.k = 1
+        k = self.k
+        while True:
+            if self.k <= 0:
+                self.k = abs(self.k) + 1 
+            else:
+                self.k = -self.k
+            if k not in self.selected:
+                return k
+            k = self.k
+
+    def next(self):
         # get next coefficient
-        ck = self.get_ck(self.k)
-        ck = FourierCoeff(self.k, ck)
-        self.coeffs.append(ck)
-        # advance k
-        if self.k <= 0:
-            self.k = abs(self.k) + 1 
+        k = self.next_freq()
+        cached = self.cached()
+        if k in cached:
+            ck = cached[k]
         else:
-            self.k = -self.k
+            ck = self.get_ck(k)
+            self.store({k: ck})
+        ck = FourierCoeff(k, np.complex128(ck))
+        self.coeffs.append(ck)
         print('next freq (k):', self.k)
         return ck
 
+    def cached(self):
+        # {freq: c} already known for the current path
+        key = self.cache_key() if self.cache is not None else None
+        return self.cache.get(key) if key is not None else { }
+
+    def store(self, computed, key=None):
+        # key is the cache_key() computed was found under, the current one
+        # by default
+        if self.cache is None:
+            return
+        key = key or self.cache_key()
+        if key is not None:
+            self.cache.update(key, computed)
+
+    def snapshot(self):
+        # a copy fixed on f's current geometry, for use on another thread
+        # while f keeps changing
+        ft = FourierTransform(None, self.t0, self.t1, self.center_on_screen)
+        pieces = self.pieces()
+        if pieces is not None:
+            ft.poly = lambda: pieces
+        else:
+            ft.samples = self.sample()
+            ft.spectrum = self.spectrum
+        return ft
+
+    def next_batch(self, n):
+        # the next n coefficients from one sampling of f
+        ks = [self.next_freq() for i in range(n)]
+        cached = self.cached()
+        missing = [k for k in ks if k not in cached]
+        if missing:
+            computed = dict(zip(missing, self.get_cks(missing).tolist()))
+            self.store(computed)
+            cached = {**cached, **computed}
+        cks = [FourierCoeff(k, np.complex128(cached[k])) for k in ks]
+        self.coeffs.extend(cks)
+        return cks
+
+    def select(self, energy=None, error=None, band=512):
+        # the fewest terms, largest radius first, that keep a fraction
+        # energy of the spectrum's power or leave an rms reconstruction
+        # error under error (by Parseval, the root of the dropped power).
+        # the spectrum is computed once for |k| <= band
+        if self.pieces() is None:
+            # stay below the nyquist frequency of the sampling grid
+            band = min(band, len(self.grid())//2 - 1)
+        ks = np.arange(-band, band+1)
+        if self.center_on_screen:
+            ks = ks[ks != 0]
+        c = self.get_cks(ks)
+        power = np.abs(c)**2
+        order = np.argsort(-power, kind='stable')
+        kept = np.cumsum(power[order])
+        if energy is not None:
+            n = np.searchsorted(kept, energy*kept[-1]) + 1
+        elif error is not None:
+            n = np.argmax(kept[-1] - kept <= error**2) + 1
+        else:
+            n = len(ks)
+        order = order[:min(n, len(ks))]
+        cks = [FourierCoeff(k, ck) for k, ck in zip(ks[order].tolist(),
+                                                    c[order])]
+        self.coeffs = cks
+        self.selected = set(ks[order].tolist())
+        return cks
+
+    def arrays(self):
+        # the current coefficients as parallel freq, c, r and phase arrays
+        freq = np.fromiter((ck.freq for ck in self.coeffs), dtype=np.int32,
+                           count=len(self.coeffs))
+        c = np.fromiter((ck.c for ck in self.coeffs), dtype=np.complex128,
+                        count=len(self.coeffs))
+        return coeffile.columns(freq, c)
+
+    def export(self, filename):
+        # the current coefficients as a coeffile
+        arrays = self.arrays()
+        coeffile.write(filename, arrays['freq'], arrays['c'])
+
+    def stream(self, filename, n, chunk=4096):
+        # like next_batch, but the n coefficients are appended to a coeffile
+        # chunk by chunk as they are computed instead of kept as FourierCoeffs
+        while n > 0:
+            ks = np.array([self.next_freq() for i in range(min(n, chunk))])
+            coeffile.append(filename, ks, self.get_cks(ks))
+            n -= len(ks)
+
+    def publish(self):
+        # the coefficients in shared memory, see sharedarrays
+        return sharedarrays.publish(self.arrays(),
+                                    meta={'center': self.center_on_screen})
+
+def poly_moments(w, degree=3):
+    # M[:, m] = integral_0^1 u^m e^(-iwu) du for m = 0..degree
+    w = np.asarray(w, dtype=float)
+    M = np.empty((len(w), degree+1), dtype=complex)
+    small = np.abs(w) < 2
+    # power series near 0, where the recurrence below loses precision
+    z = -1j*w[small]
+    term = np.ones(len(z), dtype=complex)
+    S = np.zeros((len(z), degree+1), dtype=complex)
+    for j in range(40):
+        S += np.outer(term, 1/(np.arange(degree+1) + j + 1))
+        term = term*z/(j+1)
+    M[small] = S
+    # integration by parts: M_m = (m M_(m-1) - e^(-iw))/(iw)
+    iw = 1j*w[~small]
+    e = np.exp(-iw)
+    prev = (1 - e)/iw
+    M[~small, 0] = prev
+    for m in range(1, degree+1):
+        prev = (m*prev - e)/iw
+        M[~small, m] = prev
+    return M
+
+def polynomial_piece_cks(A, bounds, ks):
+    # exact c_k contributed by each of len(A) polynomial pieces of [0,1];
+    # A[i, m] is the u^m coefficient of piece i in its own u in [0,1] and
+    # piece i covers bounds[i]..bounds[i+1] (evenly spaced if bounds is
+    # None). returns a (len(ks), len(A)) array
+    A = np.asarray(A)
+    ks = np.asarray(ks)
+    n = len(A)
+    if bounds is None:
+        M = poly_moments(2*np.pi*ks/n, A.shape[1]-1)
+        # piece i covers t = (i + u)/n
+        shift = np.exp(-2j*np.pi*np.outer(ks, np.arange(n))/n)/n
+        return shift*(M @ A.T)
+    bounds = np.asarray(bounds)
+    return span_cks(A, bounds[:-1], np.diff(bounds), ks)
+
+def span_cks(A, start, width, ks):
+    # piece i covers t = start_i + width_i*u, so its moments depend on i
+    degree = A.shape[1] - 1
+    M = poly_moments(2*np.pi*np.outer(ks, width).ravel(), degree)
+    M = M.reshape(len(ks), len(A), degree+1)
+    shift = np.exp(-2j*np.pi*np.outer(ks, start))*width
+    return shift*np.einsum('kim,im->ki', M, A)
+
+def polynomial_cks(A, bounds, ks):
+    return polynomial_piece_cks(A, bounds, ks).sum(axis=1)
+
+def polynomial_cks_many(pieces, ks):
+    # c_k of several piecewise polynomial paths, given as (A, bounds) pairs,
+    # in one vectorized pass over all their pieces. returns a
+    # (len(pieces), len(ks)) array
+    A = np.concatenate([np.asarray(a) for a, bounds in pieces])
+    bounds = [np.linspace(0, 1, len(a)+1) if b is None else np.asarray(b)
+              for a, b in pieces]
+    start = np.concatenate([b[:-1] for b in bounds])
+    width = np.concatenate([np.diff(b) for b in bounds])
+    C = span_cks(A, start, width, np.asarray(ks))
+    counts = np.array([len(a) for a, b in pieces])
+    return np.add.reduceat(C, np.cumsum(counts) - counts, axis=1).T
+
 def integrate(f,a,b,dt=0.01):
     s = 0
     n = int((b-a)/dt)
@@ -0,0 +1,100 @@
+"""
+Per-phase frame timing for the Game loop: a rolling window of the last n
+frames per phase, an on-screen overlay, JSON export, and an opt-in cProfile
+run over a number of frames.
+"""
+import json
+import time
+import pstats
+import cProfile
+import numpy as np
+from contextlib import contextmanager
+
+class FrameTimer:
+    def __init__(self, n=240):
+        self.n = n
+        self.frame = 0
+        self.samples = { } # phase => seconds spent in each of the last n frames
+        self.profiler = None
+        self.profile_frames = 0
+        self.profile_file = None
+        self.overlay = (-1, { }) # (frame, stats) last drawn by draw()
+
+    @contextmanager
+    def phase(self, name):
+        # time the enclosed block; repeated phases in a frame add up
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        if name not in self.samples:
+            self.samples[name] = np.zeros(self.n)
+        self.samples[name][self.frame % self.n] += seconds
+
+    def next_frame(self):
+        self.frame += 1
+        for samples in self.samples.values():
+            samples[self.frame % self.n] = 0
+        if self.profiler is not None:
+            self.profile_frames -= 1
+            if self.profile_frames <= 0:
+                self.stop_profile()
+
+    def window(self, name):
+        # completed frames only, oldest first
+        samples = self.samples[name]
+        count = min(self.frame, self.n - 1)
+        end = self.frame % self.n
+        return np.roll(samples, -end)[self.n - count:]
+
+    def stats(self):
+        out = { }
+        for name in self.samples:
+            ms = 1000*self.window(name)
+            if len(ms):
+                out[name] = {'mean': ms.mean(), 'p50': np.percentile(ms, 50),
+                             'p95': np.percentile(ms, 95), 'max': ms.max()}
+        return out
+
+    def histogram(self, name, bins=20):
+        # counts and edges, in milliseconds
+        return np.histogram(1000*self.window(name), bins=bins)
+
+    def export(self, filename):
+        report = {'frames': min(self.frame, self.n - 1), 'stats': self.stats(),
+                  'histograms': { }}
+        for name in self.samples:
+            counts, edges = self.histogram(name)
+            report['histograms'][name] = {'counts': counts.tolist(),
+                                          'edges_ms': edges.tolist()}
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    def profile(self, frames=300, filename='profile.prof'):
+        # run cProfile over the next frames, then dump and summarize it
+        self.profiler = cProfile.Profile()
+        self.profile_frames = frames
+        self.profile_file = filename
+        self.profiler.enable()
+
+    def stop_profile(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_file)
+        pstats.Stats(self.profiler).sort_stats('cumulative').print_stats(20)
+        print('profile written to', self.profile_file)
+        self.profiler = None
+
+    def draw(self, surf, font, pos=(10, 10), color=(0,255,0), every=30):
+        # the overlay refreshes its numbers every few frames; percentiles
+        # over the whole window cost more than the phases being measured
+        if self.frame - self.overlay[0] >= every:
+            self.overlay = (self.frame, self.stats())
+        x, y = pos
+        for name, s in self.overlay[1].items():
+            line = (f"{name:>14} {s['mean']:6.2f} ms  p95 {s['p95']:6.2f}"
+                    f"  max {s['max']:6.2f}")
+            surf.blit(font.render(line, True, color), (x, y))
+            y += font.get_linesize()
@@ -6,10 +6,16 @@ import math
 import random
 import time
 import pygame
+import pathfile
+import coeffile
+import sharedarrays
+from frametimer import FrameTimer
 from pygame.locals import *
 from collections import deque
-from fourier import FourierTransform
-from bezier_transform import example_curve, get_svg_func, Spline
+from fourier import (FourierTransform, FourierCoeff, CoeffCache, CoeffWorker,
+                     polynomial_piece_cks, polynomial_cks_many)
+from bezier_transform import (example_curve, get_svg_func, Spline,
+                              geometry_key, get_mono_ts, load_svg_contours)
 
 BG_COLOR = pygame.Color(0,0,0)
 WHITE = pygame.Color(255,255,255)
@@ -55,6 +61,74 @@ class Barpoint(Point):
         super().__init__(*args,**kwargs)
         self.root = None
 
+class PointIndex:
+    # point positions in one contiguous array, bucketed into a uniform grid
+    # of square cells, so a hit test only looks at the 3x3 cells around it
+    def __init__(self, points=(), cell=10):
+        self.cell = cell
+        self.xy = np.zeros((max(16, 2*len(points)), 2))
+        self.points = [] # slot => point
+        self.slots = { } # point => slot
+        self.cells = { } # (cx, cy) => [slot, ...]
+        for p in points:
+            self.add(p)
+
+    def cell_of(self, x, y):
+        return (int(x//self.cell), int(y//self.cell))
+
+    def add(self, point):
+        slot = len(self.points)
+        if slot == len(self.xy):
+            self.xy = np.concatenate((self.xy, np.zeros_like(self.xy)))
+        self.points.append(point)
+        self.slots[point] = slot
+        self.xy[slot] = point.xy
+        self.cells.setdefault(self.cell_of(*self.xy[slot]), []).append(slot)
+
+    def move(self, point):
+        slot = self.slots[point]
+        old = self.cell_of(*self.xy[slot])
+        self.xy[slot] = point.xy
+        new = self.cell_of(*self.xy[slot])
+        if new != old:
+            self.cells[old].remove(slot)
+            self.cells.setdefault(new, []).append(slot)
+
+    def nearest(self, pos, radius):
+        # closest point strictly within radius (<= cell) of pos, or None
+        x, y = pos
+        cx, cy = self.cell_of(x, y)
+        closest = radius
+        selected = None
+        for i in (cx-1, cx, cx+1):
+            for j in (cy-1, cy, cy+1):
+                for slot in self.cells.get((i, j), ()):
+                    px, py = self.xy[slot]
+                    ds = math.hypot(x - px, y - py)
+                    if ds < closest:
+                        closest = ds
+                        selected = self.points[slot]
+        return selected
+
+class PathUnpickler(pickle.Unpickler):
+    # saved paths were pickled from main.py running as __main__. only the
+    # classes a path is made of can be loaded, so a pickle cannot run code
+    allowed = {('__main__', 'PathBuilder'), ('__main__', 'Endpoint'),
+               ('__main__', 'Barpoint'), ('bezier_transform', 'Spline'),
+               ('pygame', '__color_constructor'),
+               ('numpy', 'ndarray'), ('numpy', 'dtype'),
+               ('numpy.core.multiarray', '_reconstruct'),
+               ('numpy.core.multiarray', 'scalar'),
+               ('numpy._core.multiarray', '_reconstruct'),
+               ('numpy._core.multiarray', 'scalar')}
+
+    def find_class(self, module, name):
+        if (module, name) not in self.allowed:
+            raise pickle.UnpicklingError(f'{module}.{name} is not allowed')
+        if module == '__main__':
+            module = __name__
+        return super().find_class(module, name)
+
 class PathBuilder:
     min_hover_dist = 10
     SAVE_DIR = os.path.join('assets','paths')
@@ -64,21 +138,81 @@ class PathBuilder:
         self.points = []
         self.n = 0
         self.dragged_point = None
+        self.arclength = False # parameterize get_point(s) by arc length
+        self.reindex()
+
+    def reindex(self):
+        self.index = PointIndex(self.points, cell=self.min_hover_dist)
+        self.children = { } # root point => Barpoints that follow it
+        for p in self.points:
+            if isinstance(p, Barpoint) and p.root is not None:
+                self.children.setdefault(p.root, []).append(p)
+        self.hovered = None
+        self.hover_pos = None # mouse position of the last hit test
 
     def save(self, index):
-        with open(f'{index}.pickle', 'wb') as f:
-            pickle.dump(self, f)
+        ids = {p: i for i, p in enumerate(self.points)}
+        curves = np.zeros((len(self.curves), 4), dtype=int)
+        for p in self.points:
+            for curve, i in p.parent_curves.items():
+                curves[self.curves.index(curve), i] = ids[p]
+        pathfile.write(f'{index}.path',
+            pos=[p.xy for p in self.points],
+            root=[ids.get(getattr(p, 'root', None), -1) for p in self.points],
+            curves=curves,
+            kind=[(pathfile.BARPOINT if isinstance(p, Barpoint)
+                   else pathfile.ENDPOINT) |
+                  (pathfile.FIRST if getattr(p, 'first', False) else 0)
+                  for p in self.points],
+            n=self.n)
 
     def load(self, index):
+        if not os.path.exists(f'{index}.path'):
+            if os.path.exists(f'{index}.pickle'):
+                print(f'{index}.pickle is from an older version, convert it '
+                      'with PathBuilder.convert_pickle if it is trusted')
+            return
+        self.read(f'{index}.path')
+        game.epicycle_manager.path_changed()
+
+    def read(self, filename):
+        data = pathfile.read(filename)
+        self.points = []
+        for xy, kind in zip(data['pos'], data['kind']):
+            if kind & pathfile.BARPOINT:
+                p = Barpoint(xy)
+            else:
+                p = Endpoint(xy)
+                p.first = bool(kind & pathfile.FIRST)
+            self.points.append(p)
+        for p, root in zip(self.points, data['root']):
+            if isinstance(p, Barpoint) and root >= 0:
+                p.root = self.points[root]
+        self.curves = []
+        for indices in data['curves']:
+            self.connect(*[self.points[i] for i in indices])
+        self.n = data['n']
+        self.dragged_point = None
+        self.reindex()
+
+    def convert_pickle(self, index):
+        # rewrite a slot saved by an older version as a .path file
+        self.load_pickle(index)
+        self.save(index)
+
+    def load_pickle(self, index):
         with open(f'{index}.pickle', 'rb') as f:
-            obj = pickle.load(f)
+            obj = PathUnpickler(f).load()
             self.curves = obj.curves
             self.points = obj.points
             self.n = obj.n
             self.dragged_point = obj.dragged_point
+        self.reindex()
 
     def get_point(self, t):
         # t is a float in [0,1]
+        if self.arclength:
+            return self.get_points([t])[0]
         n = len(self.curves)
         T = 1/n
         index, ti = divmod(t, T)
@@ -89,17 +223,101 @@ class PathBuilder:
         return complex(*self.curves[int(index)].get_point(ti*n)).conjugate()
         #t = t/T
 
+    def locate(self, t):
+        # curve index and local t for an array of path t in [0,1]
+        if self.arclength:
+            return self.locate_by_length(t)
+        t = np.asarray(t, dtype=float)
+        n = len(self.curves)
+        index = np.minimum((t*n).astype(int), n-1)
+        return index, t*n - index
+
+    def arc_index(self):
+        # cumulative arc length at the start of each curve, then the total
+        lengths = [curve.length() for curve in self.curves]
+        return np.concatenate(([0], np.cumsum(lengths)))
+
+    def locate_by_length(self, s):
+        # like locate, but s in [0,1] is a fraction of the total arc length
+        s = np.asarray(s, dtype=float)
+        bounds = self.arc_index()
+        n = len(self.curves)
+        L = s*bounds[-1]
+        index = np.clip(np.searchsorted(bounds, L, side='right') - 1, 0, n-1)
+        local = np.empty(len(s))
+        for i, curve in enumerate(self.curves):
+            mask = index == i
+            local[mask] = curve.arc_to_t(L[mask] - bounds[i])
+        return index, local
+
+    def get_points(self, t):
+        # vectorized get_point: t is an array of floats in [0,1]
+        index, local = self.locate(t)
+        n = len(self.curves)
+        # bucket the samples by curve so each spline does one matmul
+        order = np.argsort(index, kind='stable')
+        bounds = np.searchsorted(index[order], np.arange(n+1))
+        points = np.empty(len(t), dtype=complex)
+        for i, curve in enumerate(self.curves):
+            idx = order[bounds[i]:bounds[i+1]]
+            if len(idx):
+                x, y = curve.get_points(local[idx])
+                points[idx] = x - 1j*y # conjugate, as in get_point
+        return points
+
+    def get_basis(self, t):
+        # bernstein weight of each control slot at every t, so that
+        # get_points(t) == get_basis(t) @ control_vector()
+        index, local = self.locate(t)
+        weights = (Spline.B @ get_mono_ts(local)).T
+        basis = np.zeros((len(index), 4*len(self.curves)))
+        rows = np.arange(len(index))
+        for j in range(4):
+            basis[rows, 4*index + j] = weights[:,j]
+        return basis
+
+    def control_vector(self):
+        # control points as conjugated complex numbers, 4 slots per curve
+        controls = np.hstack([curve.controls for curve in self.curves])
+        return controls[0] - 1j*controls[1]
+
+    def columns(self, point):
+        # control slots that hold point, one per curve it belongs to
+        return [4*self.curves.index(curve) + i
+                for curve, i in point.parent_curves.items()]
+
+    def monomials(self):
+        # u^m coefficients of each curve as complex numbers, conjugated like
+        # get_point; None when the curves are not polynomial in t
+        if self.arclength or not self.curves:
+            return None
+        C = np.stack([curve.C for curve in self.curves])
+        return C[:,0] - 1j*C[:,1], None # curves split t evenly
+
+    def publish(self, n=1000):
+        # n samples of the path, and its control points, in shared memory
+        t = np.linspace(0, 1, n, endpoint=False)
+        return sharedarrays.publish(
+            {'t': t, 'points': self.get_points(t),
+             'controls': self.control_vector()},
+            meta={'key': self.key(), 'arclength': self.arclength})
+
+    def key(self):
+        # identifies the current shape, for caching its coefficients
+        return geometry_key(self.curves) + ('-arc' if self.arclength else '')
+
     def collisions(self):
+        # hovered point; the index is only queried when the mouse moved
         mp = ui.mousepos 
-        closest = 2e20
-        selected = None
-        for p in self.points:
-            p.color = p._color
-            ds = np.linalg.norm(mp - p.xy)
-            if ds < closest:
-                closest = ds
-                selected = p
-        return selected if closest < self.min_hover_dist else None
+        if mp == self.hover_pos:
+            return self.hovered
+        self.hover_pos = mp
+        selected = self.index.nearest(mp, self.min_hover_dist)
+        if selected is not self.hovered:
+            if self.hovered is not None:
+                self.hovered.color = self.hovered._color
+            self.hovered = selected
+        return selected
 
 
     def connect(self, a, b, c, d):
@@ -119,28 +337,35 @@ class PathBuilder:
         elif self.dragged_point: 
             ds = ui.mousepos - ui.mousepos_history[0]
             #self.dragged_point.pos = ui.mousepos
+            prev = self.dragged_point.xy
             self.dragged_point.pos = (min(game.windows[0].r, ui.mousepos[0]),
                                       min(game.windows[0].b, ui.mousepos[1]))
+            game.epicycle_manager.move_point(self.dragged_point,
+                                             self.dragged_point.xy - prev)
+            self.index.move(self.dragged_point)
             #self.dragged_point.pos += ds 
 
             # translate any child control points attatched to the dragged_point
-            children = [i for i in self.points 
-                    if isinstance(i,Barpoint) and i.root is self.dragged_point]
+            children = self.children.get(self.dragged_point, ())
             for child in children:
                 child.pos += ds
+                game.epicycle_manager.move_point(child, ds)
+                self.index.move(child)
+            for child in children:
                 for curve, index in child.parent_curves.items():
                     curve.update_controls(index, child.pos)
-                    #curve.sample(use_cache=False)
 
             for curve, index in self.dragged_point.parent_curves.items():
-                # update curves that depend on the dragged point
+                # update curves that depend on the dragged point; they are
+                # marked dirty and resampled once, when next drawn
                 curve.update_controls(index, self.dragged_point.pos)
-                curve.sample(use_cache=False)
+            game.epicycle_manager.controls_moved()
             
 
         if ui.clicked:
             if self.dragged_point:
                 self.dragged_point = None
+                self.hover_pos = None # the point moved under the mouse
             elif game.windows[0].contains(ui.mousepos):
                 self.place_point(ui.mousepos)
 
@@ -152,15 +377,21 @@ class PathBuilder:
                 p.first = True
             else:
                 self.connect(*self.points[-3:], p)
-                self.points[-1].root = p # connect endpoint (4) to 3rd control 
+                self.attach(self.points[-1], p) # connect endpoint (4) to 3rd control 
         elif i in [1,2]:
             p = Barpoint(point)
             if i == 1:
-                p.root = self.points[-1] # connect startpoint (1) to 2nd control
+                self.attach(p, self.points[-1]) # connect startpoint (1) to 2nd control
 
         self.points.append(p)
+        self.index.add(p)
+        self.hover_pos = None # a point appeared under the mouse
         self.n += 1
 
+    def attach(self, child, root):
+        child.root = root
+        self.children.setdefault(root, []).append(child)
+
     def draw(self, surf):
         for p in self.points:
             #if p in Barpoint.group:
@@ -175,65 +406,184 @@ class PathBuilder:
             pygame.draw.aalines(surf, WHITE, False, points)
 
         
-class Epicycler:
-    group = []
+class EpicycleChain:
     scale = 1#20
-    def __init__(self, parent=None, 
-                       radius=1, phase=0, freq=1,
-                       slowdown=1, color=WHITE):
-        self.parent = parent
-        self.group.append(self)
-        self.r = radius
-        self.phase = phase
-        self.freq = freq
-        self.angular = freq*2*np.pi
+    def __init__(self, center, pencil_color=BLUE, trace=True):
+        # struct of arrays: one entry per circle, chains stored back to back
+        self.r = np.zeros(0)
+        self.freq = np.zeros(0)
+        self.phase = np.zeros(0)
+        self.colors = []
+        self.rgb = np.zeros((0,3), dtype=int)
+        self.lengths = np.zeros(1, dtype=int) # circles in each chain
+        self.centers = np.array([complex(*center)])
+        # origin of each circle, then the tip, per chain
+        self.points = self.centers.copy()
 
         # display settings
-        self.slowdown = slowdown 
-        self.color = color
         self.w = 3
+        self.trace = trace
+        self.trace_resolution = 1024 # trace points per period
+        # time each pencil started tracing its current chain (nan: at the
+        # next get_tips), and the unscaled pencil path, see trace_table
+        self.trace_start = np.full(1, np.nan)
+        self.table = None
+        self.t = 0
+        self.pencil_color = pencil_color
 
-        self.get_tip() # initialize tip
-
-    def update(self, dt):
-        self.get_tip()
+    def __len__(self):
+        return len(self.r)
 
-    def get_tip(self):
-        R = self.scale*self.r
-        self.origin = self.parent.tip if self.parent else Game.windows[1].center
-        self.tip = self.origin + R*np.array(
-                (math.cos(-(self.angular*game.epicycle_manager.t + self.phase)),
-                 math.sin(-(self.angular*game.epicycle_manager.t + self.phase))))
-        # the negative angle is due to pygame reversing positive=CCW convention 
+    @property
+    def starts(self):
+        # index in points of each chain's center
+        return np.cumsum(self.lengths + 1) - self.lengths - 1
 
-    def draw(self, surf):
-        pygame.draw.line(surf, self.color, self.origin,
-                         self.tip, width=self.w)
-        pygame.draw.circle(surf, self.color, self.origin, # ring
-                           self.scale*self.r, width=1)
-        pygame.draw.circle(surf, self.color, self.tip, # tip
-                           max(1, self.scale*self.r/12))
-
-class Pencil(Epicycler):
-    def __init__(self, *args, pencil_color=BLUE, trace=True,
-                trace_len=1000, **kwargs):
-        self.trace = trace
-        self.trace_len = int(game.epicycle_manager.slowdown*game.fps) #trace_len
-        self.pos_history = deque(maxlen=self.trace_len)
-        self.pencil_color = pencil_color
-        super().__init__(*args, **kwargs)
+    @property
+    def origins(self):
+        if len(self.lengths) == 1:
+            return self.points[:-1].view(float).reshape(-1,2)
+        ends = self.starts + self.lengths
+        return np.delete(self.points, ends).view(float).reshape(-1,2)
 
-    def get_tip(self):
-        super().get_tip()
-        self.pos_history.append(self.tip)
+    @property
+    def tips(self):
+        if len(self.lengths) == 1:
+            return self.points[1:].view(float).reshape(-1,2)
+        return np.delete(self.points, self.starts).view(float).reshape(-1,2)
+
+    def extend(self, radii, freqs, phases):
+        # add circles to the end of the last chain
+        self.r = np.concatenate((self.r, radii))
+        self.freq = np.concatenate((self.freq, freqs))
+        self.phase = np.concatenate((self.phase, phases))
+        self.lengths[-1] += len(radii)
+        self.trace_start[-1] = np.nan # the pencil moved to the new last circle
+        self.table = None
+        self.recolor()
+
+    def add_chain(self, radii, freqs, phases, center):
+        # start another chain, drawn alongside the others
+        if self.lengths[-1]:
+            self.lengths = np.append(self.lengths, 0)
+            self.centers = np.append(self.centers, complex(*center))
+            self.trace_start = np.append(self.trace_start, np.nan)
+        else:
+            self.centers[-1] = complex(*center)
+        self.extend(radii, freqs, phases)
+
+    def recolor(self):
+        self.colors = [BG_COLOR.lerp(WHITE, 0.2*(1-L) + 0.8*L)
+                       for n in self.lengths for L in np.arange(1, n+1)/n]
+        self.rgb = np.array([tuple(c)[:3] for c in self.colors]).reshape(-1,3)
+
+    def set(self, radii, phases):
+        self.r[:] = radii
+        self.phase[:] = phases
+        self.table = None
+
+    def get_tips(self, t):
+        # the negative angle is due to pygame reversing positive=CCW convention 
+        z = self.scale*self.r*np.exp(-1j*(2*np.pi*self.freq*t + self.phase))
+        starts = self.starts
+        steps = np.empty(len(self) + len(starts), dtype=complex)
+        arms = np.ones(len(steps), dtype=bool)
+        arms[starts] = False
+        steps[starts] = self.centers
+        steps[arms] = z
+        # one cumsum over every chain, less what earlier chains carried in
+        self.points = np.cumsum(steps)
+        carry = np.concatenate(([0], self.points[starts[1:] - 1]))
+        self.points -= np.repeat(carry, self.lengths + 1)
+        self.t = t
+        self.trace_start[np.isnan(self.trace_start)] = t
+
+    def trace_table(self):
+        # every chain's pencil, unscaled and uncentered, at trace_resolution
+        # evenly spaced t over one period. the frequencies are integers, so
+        # this is one fft of the coefficients; it only changes with them,
+        # not with the scale or the time
+        if self.table is None:
+            N = self.trace_resolution
+            a = np.zeros((len(self.lengths), N), dtype=complex)
+            chain = np.repeat(np.arange(len(self.lengths)), self.lengths)
+            np.add.at(a, (chain, self.freq.astype(int) % N),
+                      self.r*np.exp(-1j*self.phase))
+            self.table = np.fft.fft(a, axis=1)
+        return self.table
+
+    def trace_window(self):
+        # (n, 2) pencil points of each chain over the last period, or since
+        # it started tracing, ending at the current tip
+        table = self.trace_table()
+        N = self.trace_resolution
+        tips = self.points[self.starts + self.lengths]
+        windows = []
+        for i, start in enumerate(np.maximum(self.trace_start, self.t - 1)):
+            if not self.lengths[i] or np.isnan(start):
+                windows.append(np.zeros((0, 2)))
+                continue
+            j = np.arange(math.ceil(start*N), math.ceil(self.t*N))
+            z = np.append(self.centers[i] + self.scale*table[i, j % N], tips[i])
+            windows.append(z.view(float).reshape(-1,2))
+        return windows
+
+    def retrace(self, start):
+        # trace every pencil from time start, as if it had been drawing then
+        self.trace_start[:] = start
 
     def draw(self, surf):
-        super().draw(surf)
-        if self.trace and len(self.pos_history) > 1:
-            for i in range(len(self.pos_history)-1):
-                n = len(self.pos_history)
-                pygame.draw.line(surf, BG_COLOR.lerp(self.pencil_color, i/n), 
-                            self.pos_history[i], self.pos_history[i+1], width=2)
+        origins, tips = self.origins, self.tips
+        R = self.scale*self.r
+        # arms: one polyline per run of circles sharing a color band
+        for start, first, n in zip(self.starts, np.cumsum(self.lengths) -
+                                   self.lengths, self.lengths):
+            for a, b in fade_bands(n):
+                pygame.draw.lines(surf, self.colors[first+a], False,
+                                  self.points[start+a:start+b+1]
+                                      .view(float).reshape(-1,2),
+                                  width=self.w)
+        # rings under a pixel across draw nothing, so skip them
+        for i in np.flatnonzero(R >= 1):
+            pygame.draw.circle(surf, self.colors[i], origins[i], R[i], width=1)
+        # tips: large ones individually, 1px ones as one pixel write
+        small = R <= 12
+        for i in np.flatnonzero(~small):
+            pygame.draw.circle(surf, self.colors[i], tips[i], R[i]/12)
+        if small.any():
+            draw_dots(surf, tips[small], self.rgb[small])
+
+        if not self.trace:
+            return
+        for points in self.trace_window():
+            if len(points) < 2:
+                continue
+            n = len(points)
+            for a, b in fade_bands(n-1):
+                pygame.draw.lines(surf,
+                                  BG_COLOR.lerp(self.pencil_color, (a+b-1)/2/n),
+                                  False, points[a:b+1], width=2)
+
+def fade_bands(n, count=16):
+    # split range(n) into at most count runs for drawing a fade in bands;
+    # with n <= count every index is its own run
+    if n <= 0:
+        return []
+    band = (np.arange(n)*count)//n
+    edges = np.flatnonzero(np.diff(band)) + 1
+    return list(zip(np.r_[0, edges], np.r_[edges, n]))
+
+def draw_dots(surf, points, colors):
+    # same pixels as pygame.draw.circle(surf, color, p, 1) for every point:
+    # the 2x2 block up and left of the floored position
+    w, h = surf.get_size()
+    xy = np.floor(points).astype(int)
+    pixels = pygame.surfarray.pixels3d(surf)
+    for dx, dy in ((-1,-1),(0,-1),(-1,0),(0,0)):
+        x, y = xy[:,0] + dx, xy[:,1] + dy
+        inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+        pixels[x[inside], y[inside]] = colors[inside]
+    del pixels # unlock the surface
 
 class Window:
     def __init__(self, w, h, x_off=0, y_off=0):
@@ -255,67 +605,265 @@ class Window:
         pygame.draw.line(surf, WHITE, self.top_right, self.bot_right, width=2)
 
 class EpicycleManager:
-    def __init__(self, time_series_func): 
+    COEFF_DIR = os.path.join('assets','coeffs')
+
+    def __init__(self, time_series_func, vector_func=None, key_func=None,
+                 poly_func=None): 
         self.slowdown = 10
         self.t = 0
         self.time_series_func = time_series_func
+        self.vector_func = vector_func
+        self.key_func = key_func
+        self.poly_func = poly_func
+        self.coeff_cache = CoeffCache(directory=self.COEFF_DIR)
+        self.worker = CoeffWorker()
+        self.per_frame = 10 # most queued circles added in one update
         self.reset_fourier()
             
     def add_fourier_cycle(self):
         if len(game.path_builder.curves) < 1:
             return
-        parent = self.epis[-1] if self.epis else None
-        if parent:
-            parent.trace = False
+        self.add_epicycle(self.ft.next())
 
-        ck = self.ft.next() 
+    def add_fourier_cycles(self, n):
+        # compute n coefficients in one batch instead of n integrations
+        if len(game.path_builder.curves) < 1:
+            return
+        self.add_epicycles(self.ft.next_batch(n))
 
-        ## create epicycle
-        epi = Pencil(parent=parent, radius=ck.r, freq=ck.freq, phase=ck.phase,
-                     slowdown=self.slowdown, trace=True, color=WHITE) 
-        self.epis.append(epi)
+    def queue_fourier_cycles(self, n):
+        # like add_fourier_cycles, but computed on the worker thread;
+        # update() adds the circles in order as their coefficients arrive
+        if len(game.path_builder.curves) < 1:
+            return
+        ks = [self.ft.next_freq() for i in range(n)]
+        self.pending.extend(ks)
+        self.request(ks)
+
+    def request(self, ks):
+        # cached coefficients arrive at once, the rest from the worker
+        self.requested_key = self.ft.cache_key()
+        cached = self.ft.cached()
+        self.arrived.update((k, cached[k]) for k in ks if k in cached)
+        missing = [k for k in ks if k not in cached]
+        if missing:
+            self.worker.submit(self.ft, missing)
+
+    def controls_moved(self):
+        # called once a frame during a drag, after every curve has its new
+        # controls. unless move_point gave up on them, the coefficients
+        # followed the controls
+        if self.coeffs_key is not None:
+            self.coeffs_key = self.ft.cache_key()
+        self.sync()
+        self.path_changed()
+
+    def sync(self):
+        # the circles shown were computed on the path under coeffs_key; if
+        # it is not the current one (a curve was added, a path loaded, or
+        # move_point could not follow a drag), re-transform them from one
+        # fresh sampling
+        key = self.ft.cache_key()
+        n = len(self.chain)
+        if key != self.coeffs_key and 0 < n <= len(self.ft.coeffs):
+            shown = self.ft.coeffs[:n]
+            for ck, c in zip(shown, self.ft.get_cks([ck.freq
+                                                     for ck in shown])):
+                ck.set(c)
+            self.chain.set([ck.r for ck in shown],
+                           [ck.phase for ck in shown])
+        self.coeffs_key = key
+
+    def path_changed(self):
+        # the path has new controls: whatever is still queued was computed,
+        # or is being computed, for the old shape
+        if self.pending:
+            self.worker.cancel()
+            self.arrived = { }
+            self.request(list(self.pending))
+
+    def take_arrivals(self):
+        key = self.ft.cache_key()
+        if key != self.requested_key:
+            # the path changed without path_changed(), e.g. a placed point
+            # completed a curve: nothing requested will ever be current
+            self.path_changed()
+        for job_key, ks, computed in self.worker.poll():
+            if isinstance(computed, Exception):
+                print('coefficients failed:', computed)
+                if job_key == key: # they will never arrive
+                    failed = set(ks)
+                    self.pending = deque(k for k in self.pending
+                                         if k not in failed)
+                continue
+            # cached under the shape they belong to, used only if it is
+            # still the current one
+            self.ft.store(computed, job_key)
+            if job_key == key:
+                self.arrived.update(computed)
+        cks = []
+        while self.pending and self.pending[0] in self.arrived and \
+              len(cks) < self.per_frame:
+            k = self.pending.popleft()
+            cks.append(FourierCoeff(k, np.complex128(self.arrived.pop(k))))
+        if cks:
+            self.ft.coeffs.extend(cks)
+            self.add_epicycles(cks)
+
+    def select_fourier(self, energy=None, error=None):
+        # rebuild the chain from the fewest circles meeting the budget
+        if len(game.path_builder.curves) < 1:
+            return
+        self.reset_fourier()
+        self.add_epicycles(self.ft.select(energy=energy, error=error))
+        print('selected terms:', len(self.chain))
 
-        # recolor epicycles
-        n = len(self.epis)
-        for i, e in enumerate(self.epis):
-            L = (i+1)/n 
-            e.color = BG_COLOR.lerp(WHITE, 0.2*(1-L) + 0.8*L)
+    def show_svg(self, svg_filepath, terms):
+        # every contour of the svg gets its own chain, all transformed in
+        # one vectorized pass and drawn together
+        contours = load_svg_contours(svg_filepath)
+        self.reset_fourier()
+        order = FourierTransform(None)
+        ks = np.array([order.next_freq() for i in range(terms)])
+        C = polynomial_cks_many([contour.pieces() for contour in contours], ks)
+        # center the whole glyph in the window and scale it to fit
+        points = np.concatenate([contour.get_points(np.linspace(0,1,256))
+                                 for contour in contours])
+        lo = complex(points.real.min(), points.imag.min())
+        hi = complex(points.real.max(), points.imag.max())
+        C[:, ks == 0] -= (lo + hi)/2
+        C *= 0.8*Game.windows[1].h/(max((hi - lo).real, (hi - lo).imag) or 1)
+        for row in C:
+            cks = [FourierCoeff(k, c) for k, c in zip(ks.tolist(), row)]
+            self.chain.add_chain([ck.r for ck in cks], ks,
+                                 [ck.phase for ck in cks],
+                                 Game.windows[1].center)
+        self.chain.get_tips(self.t)
+
+    def save_coeffs(self, filename):
+        self.ft.export(filename)
+
+    def load_coeffs(self, filename, terms=None):
+        # show the first terms coefficients of a coeffile, taken straight
+        # from its columns; like show_svg, nothing is left to drag
+        columns = coeffile.read(filename)
+        self.reset_fourier()
+        self.chain.extend(columns['r'][:terms], columns['freq'][:terms],
+                          columns['phase'][:terms])
+        self.chain.get_tips(self.t)
+
+    def add_epicycle(self, ck):
+        self.add_epicycles([ck])
+
+    def add_epicycles(self, cks):
+        self.sync() # the circles already shown may be of an older path
+        self.chain.extend([ck.r for ck in cks], [ck.freq for ck in cks],
+                          [ck.phase for ck in cks])
+        self.chain.get_tips(self.t)
+
+    def contributions(self):
+        # c = W @ path_builder.control_vector() for the active coefficients;
+        # W depends only on the topology, so it is kept for a whole drag
+        ks = [ck.freq for ck in self.ft.coeffs]
+        key = (tuple(ks), len(game.path_builder.curves))
+        if self.W_key != key:
+            n = len(game.path_builder.curves)
+            if self.ft.pieces() is not None:
+                # slot j of each curve carries the bernstein polynomial B[j]
+                W = [polynomial_piece_cks(np.tile(b, (n,1)), None, ks)
+                     for b in Spline.B]
+                self.W = np.stack(W, axis=2).reshape(len(ks), 4*n)
+            else:
+                basis = game.path_builder.get_basis(self.ft.grid())
+                self.W = self.ft.get_cks(ks, y=basis)
+            self.W_key = key
+        return self.W
+
+    def move_point(self, point, delta):
+        # a moved control point is a rank-one update of every coefficient
+        if not len(self.chain) or len(self.chain) != len(self.ft.coeffs):
+            return # nothing, or not showing the path builder's path
+        if game.path_builder.arclength or \
+           self.coeffs_key != self.ft.cache_key():
+            # with arc length the mapping moves too, so c is not linear in
+            # the controls; otherwise W is for a path the coefficients were
+            # not computed on. either way, controls_moved re-transforms
+            self.coeffs_key = None
+            return
+        cols = game.path_builder.columns(point)
+        dz = complex(delta[0], -delta[1])
+        dc = self.contributions()[:,cols].sum(axis=1)*dz
+        for ck, d in zip(self.ft.coeffs, dc):
+            ck.set(ck.c + d)
+        self.chain.set([ck.r for ck in self.ft.coeffs],
+                       [ck.phase for ck in self.ft.coeffs])
 
     def reset_fourier(self):
+        self.worker.cancel()
+        self.pending = deque() # freqs queued on the worker, in chain order
+        self.arrived = { }
+        self.requested_key = None # cache key the pending freqs were asked on
+        self.W = None
+        self.W_key = None
+        self.coeffs_key = None # cache key of the path the chain shows
         self.ft = FourierTransform(self.time_series_func,
-                                    center_on_screen=True)
-        self.epis = []
+                                    center_on_screen=True,
+                                    vf=self.vector_func,
+                                    cache=self.coeff_cache,
+                                    key=self.key_func,
+                                    poly=self.poly_func)
+        self.chain = EpicycleChain(Game.windows[1].center)
 
     def update(self, dt):
         self.t += dt/1000/self.slowdown
-        for epi in self.epis:
-            epi.update(dt)
+        if self.pending:
+            self.take_arrivals()
+        self.chain.get_tips(self.t)
 
     def draw(self, surf):
-        for epi in self.epis:
-            epi.draw(surf)
+        self.chain.draw(surf)
 
 class Game:
     W = 1600#1920#640
     H = 800#1080#480
     center = np.array((W/2, H/2))
     windows = [Window(W/2,H,0,0), Window(W/2,H,x_off=W/2,y_off=0)]
+    fps = 60.0
 
     def __init__(self):
-        self.fps = 60.0
         self.width = Game.W
         self.height = Game.H
         self.clock = pygame.time.Clock()
         pygame.init()
         self.screen = pygame.display.set_mode((self.width, self.height))
         self.dt = 1/self.fps 
+        self.timer = FrameTimer()
+        self.show_timings = False
+        self.font = pygame.font.Font(None, 20)
 
         #self.ft = FourierTransform(get_svg_func('svgs/xi.svg'),
         #                           center_on_screen=True)
         self.path_builder = PathBuilder()
-        self.epicycle_manager = EpicycleManager(self.path_builder.get_point)
+        self.epicycle_manager = EpicycleManager(self.path_builder.get_point,
+                                                self.path_builder.get_points,
+                                                self.path_builder.key,
+                                                self.path_builder.monomials)
 
     def update(self, dt):
+        with self.timer.phase('events'):
+            self.handle_events()
+
+        ui.update(dt)
+
+        with self.timer.phase('path_builder'):
+            self.path_builder.update(dt)
+        with self.timer.phase('epicycles'):
+            self.epicycle_manager.update(dt)
+
+        #for epi in Epicycler.group:
+        #    epi.update(dt)
+
+    def handle_events(self):
         for event in pygame.event.get():
             if event.type == QUIT:
                 pygame.quit() 
@@ -326,16 +874,33 @@ class Game:
                     pygame.quit()
                     sys.exit()
                 if event.key == K_e:
-                    game.epicycle_manager.add_fourier_cycle()
-                if event.key == K_w:
-                    for i in range(50):
+                    with self.timer.phase('coefficients'):
                         game.epicycle_manager.add_fourier_cycle()
+                if event.key == K_w:
+                    with self.timer.phase('coefficients'):
+                        game.epicycle_manager.queue_fourier_cycles(50)
                 if event.key == K_j:
-                    Epicycler.scale /= 1.25
+                    EpicycleChain.scale /= 1.25
                 if event.key == K_k:
-                    Epicycler.scale *= 1.25
+                    EpicycleChain.scale *= 1.25
                 if event.key == K_r:
                     game.epicycle_manager.reset_fourier()
+                if event.key == K_q:
+                    with self.timer.phase('coefficients'):
+                        game.epicycle_manager.select_fourier(energy=0.9999)
+                if event.key == K_t:
+                    self.show_timings = not self.show_timings
+                if event.key == K_y:
+                    self.timer.export('timings.json')
+                    print('timings written to timings.json')
+                if event.key == K_c:
+                    game.epicycle_manager.save_coeffs('spectrum.coeffs')
+                    print('coefficients written to spectrum.coeffs')
+                if event.key == K_p and self.timer.profiler is None:
+                    self.timer.profile(frames=300)
+                if event.key == K_a:
+                    game.path_builder.arclength = not game.path_builder.arclength
+                    game.epicycle_manager.reset_fourier()
 
                 if event.key == K_s:
                     ui.state = 'saving'
@@ -359,29 +924,27 @@ class Game:
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == 1:
                     ui.mousestate = 'down'
-
-        ui.update(dt)
-
-        self.path_builder.update(dt)
-        self.epicycle_manager.update(dt)
-
-        #for epi in Epicycler.group:
-        #    epi.update(dt)
-
      
     def draw(self):
-        self.screen.fill(BG_COLOR) 
+        self.render(self.screen)
+        if self.show_timings:
+            self.timer.draw(self.screen, self.font)
+        with self.timer.phase('flip'):
+            pygame.display.flip()
 
-        for window in Game.windows:
-            window.draw(self.screen)
+    def render(self, surf):
+        with self.timer.phase('draw_windows'):
+            surf.fill(BG_COLOR) 
+
+            for window in Game.windows:
+                window.draw(surf)
 
         #for epi in Epicycler.group:
         #    epi.draw(self.screen)
-        self.path_builder.draw(self.screen)
-        self.epicycle_manager.draw(self.screen)
-
-
-        pygame.display.flip()
+        with self.timer.phase('draw_path'):
+            self.path_builder.draw(surf)
+        with self.timer.phase('draw_epicycles'):
+            self.epicycle_manager.draw(surf)
      
     def run(self):
         started = False
@@ -393,7 +956,9 @@ class Game:
             #if not started:
             #    time.sleep(2)
             #    started = True
-            dt = self.clock.tick(self.fps) # fix timing bug
+            with self.timer.phase('idle'):
+                dt = self.clock.tick(self.fps) # fix timing bug
+            self.timer.next_frame()
 
 class UI:
     def __init__(self):
@@ -416,6 +981,14 @@ class UI:
             self.dragging = False
 
 ui = UI()
-
-game = Game()
-game.run()
+game = None # set by whoever drives the Game: run() below, or render.py
+
+if __name__ == '__main__':
+    game = Game()
+    if len(sys.argv) > 1: # python main.py some.svg|some.coeffs [terms]
+        terms = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        if sys.argv[1].endswith('.coeffs'):
+            game.epicycle_manager.load_coeffs(sys.argv[1], terms)
+        else:
+            game.epicycle_manager.show_svg(sys.argv[1], terms or 100)
+    game.run()
@@ -0,0 +1,60 @@
+"""
+Versioned flat file format for PathBuilder paths. A 24 byte header is
+followed by plain little-endian arrays, so a file is read with a single
+np.fromfile and nothing in it is ever executed:
+
+    header  magic b'EPCY', version, flags, #points, #curves, n, reserved
+    pos     float64 (points, 2)  point positions
+    root    int32   (points,)    index of a Barpoint's root, or -1
+    curves  int32   (curves, 4)  point indices of each spline's controls
+    kind    uint8   (points,)    ENDPOINT or BARPOINT, | FIRST
+"""
+import numpy as np
+
+MAGIC = b'EPCY'
+VERSION = 1
+HEADER = np.dtype([('magic','S4'), ('version','<u2'), ('flags','<u2'),
+                   ('points','<u4'), ('curves','<u4'), ('n','<u4'),
+                   ('reserved','<u4')])
+ENDPOINT, BARPOINT, FIRST = 0, 1, 2
+
+def sections(points, curves):
+    # (name, dtype, shape) of each array, in file order
+    return [('pos', '<f8', (points, 2)), ('root', '<i4', (points,)),
+            ('curves', '<i4', (curves, 4)), ('kind', 'u1', (points,))]
+
+def write(filename, pos, root, curves, kind, n):
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['points'] = len(pos)
+    header['curves'] = len(curves)
+    header['n'] = n
+    arrays = {'pos': pos, 'root': root, 'curves': curves, 'kind': kind}
+    with open(filename, 'wb') as f:
+        header.tofile(f)
+        for name, dtype, shape in sections(len(pos), len(curves)):
+            np.ascontiguousarray(arrays[name], dtype=dtype).reshape(shape).tofile(f)
+
+def read(filename):
+    data = np.fromfile(filename, dtype=np.uint8)
+    if len(data) < HEADER.itemsize:
+        raise ValueError(f'{filename}: truncated header')
+    header = data[:HEADER.itemsize].view(HEADER)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError(f'{filename}: not a path file')
+    if header['version'] != VERSION:
+        raise ValueError(f'{filename}: unsupported version {header["version"]}')
+    out = {'n': int(header['n'])}
+    offset = HEADER.itemsize
+    for name, dtype, shape in sections(int(header['points']),
+                                       int(header['curves'])):
+        size = np.dtype(dtype).itemsize*int(np.prod(shape))
+        if offset + size > len(data):
+            raise ValueError(f'{filename}: truncated {name}')
+        out[name] = data[offset:offset+size].view(dtype).reshape(shape)
+        offset += size
+    if (out['root'] >= len(out['pos'])).any() or \
+       (out['curves'] < 0).any() or (out['curves'] >= len(out['pos'])).any():
+        raise ValueError(f'{filename}: point index out of range')
+    return out
@@ -0,0 +1,168 @@
+"""
+Headless offline renderer: steps the epicycles of a saved path (or of every
+contour of an svg) with a fixed timestep and streams each frame out as it is
+drawn, either to a numbered PNG sequence or to the stdin of an encoder, e.g.
+
+    python render.py 3 200 -o frames/
+    python render.py svgs/capital-xi.svg 100 -o frames/
+    python render.py 3 200 --pipe "ffmpeg -y -f rawvideo -pix_fmt rgb24
+        -s 1600x800 -r 60 -i - out.mp4"
+
+With -j, frame ranges are rendered by that many worker processes. The
+coefficients are computed once and shared with the workers (see
+sharedarrays); each worker jumps straight to the first frame of its range,
+with the pencil trace evaluated from the coefficients, and the ranges are
+written out in order.
+"""
+import os
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import sys
+import shlex
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pygame
+import main
+import sharedarrays
+from concurrent.futures import ProcessPoolExecutor
+from main import Game
+
+def setup(source, terms):
+    # a Game on the dummy video driver showing terms circles of source,
+    # a save slot or an svg file
+    game = main.game = Game()
+    if str(source).lower().endswith('.svg'):
+        game.epicycle_manager.show_svg(source, terms)
+    else:
+        game.path_builder.load(source)
+        game.epicycle_manager.add_fourier_cycles(terms)
+    return game
+
+def frames(game, n, fps=Game.fps):
+    # yields the same off-screen surface after each of n fixed steps
+    surf = pygame.Surface((Game.W, Game.H))
+    dt = 1000/fps
+    for i in range(n):
+        game.epicycle_manager.update(dt)
+        game.render(surf)
+        yield surf
+
+def times(n, fps=Game.fps, slowdown=10):
+    # EpicycleManager.t after each of 0..n fixed steps, summed the same way
+    step = 1000/fps/1000/slowdown
+    return np.add.accumulate(np.r_[0.0, np.full(n, step)])
+
+def publish_chain(game):
+    # the chain of a set up game, for the workers to rebuild
+    em = game.epicycle_manager
+    chain = em.chain
+    return sharedarrays.publish(
+        {'r': chain.r, 'freq': chain.freq, 'phase': chain.phase,
+         'lengths': chain.lengths, 'centers': chain.centers},
+        meta={'slowdown': em.slowdown, 'scale': main.EpicycleChain.scale})
+
+def restore(source, descriptor):
+    # a Game drawing the published chain, without computing anything
+    game = main.game = Game()
+    if not str(source).lower().endswith('.svg'):
+        game.path_builder.load(source)
+    em = game.epicycle_manager
+    with sharedarrays.attach(descriptor) as shared:
+        em.slowdown = shared.meta['slowdown']
+        main.EpicycleChain.scale = shared.meta['scale']
+        em.reset_fourier()
+        ends = np.cumsum(shared['lengths'])
+        for center, start, end in zip(shared['centers'], ends -
+                                      shared['lengths'], ends):
+            em.chain.add_chain(shared['r'][start:end].copy(),
+                               shared['freq'][start:end].copy(),
+                               shared['phase'][start:end].copy(),
+                               (center.real, center.imag))
+    return game
+
+def render_range(source, descriptor, start, stop, fps, out):
+    # frames start..stop-1 of the animation: pngs into out, or raw rgb24
+    # into a temporary file whose name is returned
+    game = restore(source, descriptor)
+    em = game.epicycle_manager
+    em.t = times(start, fps, em.slowdown)[-1]
+    em.chain.retrace(0) # when setup's chain started tracing
+    if out is None:
+        f = tempfile.NamedTemporaryFile(suffix='.rgb', delete=False)
+        with f:
+            for surf in frames(game, stop - start, fps):
+                f.write(pygame.image.tobytes(surf, 'RGB'))
+        return f.name
+    for i, surf in enumerate(frames(game, stop - start, fps), start):
+        pygame.image.save(surf, os.path.join(out, f'frame_{i:05d}.png'))
+    return None
+
+def render_parallel(game, source, n, fps, out, pipe, workers):
+    # raw ranges are kept small so the encoder is fed while others render
+    count = workers*4 if pipe else workers
+    bounds = np.linspace(0, n, min(count, n) + 1).astype(int).tolist()
+    shared = publish_chain(game)
+    if pipe:
+        encoder = subprocess.Popen(shlex.split(pipe), stdin=subprocess.PIPE)
+    else:
+        os.makedirs(out, exist_ok=True)
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(render_range,
+                               *zip(*[(source, shared.descriptor, a, b, fps,
+                                       None if pipe else out)
+                                      for a, b in zip(bounds, bounds[1:])]))
+            for filename in results: # in order, as each range finishes
+                if filename is None:
+                    continue
+                with open(filename, 'rb') as f:
+                    while chunk := f.read(1 << 24):
+                        encoder.stdin.write(chunk)
+                os.remove(filename)
+    finally:
+        shared.unlink()
+        if pipe:
+            encoder.stdin.close()
+            encoder.wait()
+    return encoder.returncode if pipe else 0
+
+def render(source, terms, n=None, fps=Game.fps, out='frames', pipe=None,
+           workers=1):
+    game = setup(source, terms)
+    if n is None: # one full period of the path
+        n = int(game.epicycle_manager.slowdown*fps)
+    if workers > 1:
+        return render_parallel(game, source, n, fps, out, pipe, workers)
+    if pipe:
+        encoder = subprocess.Popen(shlex.split(pipe), stdin=subprocess.PIPE)
+        try:
+            for surf in frames(game, n, fps):
+                encoder.stdin.write(pygame.image.tobytes(surf, 'RGB'))
+        finally:
+            encoder.stdin.close()
+            encoder.wait()
+        return encoder.returncode
+    os.makedirs(out, exist_ok=True)
+    for i, surf in enumerate(frames(game, n, fps)):
+        pygame.image.save(surf, os.path.join(out, f'frame_{i:05d}.png'))
+    return 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='render epicycles offline')
+    parser.add_argument('source', help='saved path slot number, or an svg')
+    parser.add_argument('terms', type=int, help='number of fourier terms')
+    parser.add_argument('-n', '--frames', type=int, default=None,
+                        help='frames to render (default: one period)')
+    parser.add_argument('--fps', type=float, default=Game.fps)
+    parser.add_argument('-o', '--out', default='frames',
+                        help='directory for the png sequence')
+    parser.add_argument('--pipe', default=None,
+                        help='encoder command reading raw rgb24 on stdin')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='worker processes rendering frame ranges')
+    args = parser.parse_args()
+    sys.exit(render(args.source, args.terms, args.frames, args.fps,
+                    args.out, args.pipe, args.workers))
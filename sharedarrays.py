@@ -0,0 +1,93 @@
+"""
+Named numpy arrays in one multiprocessing.shared_memory block, so other
+processes (render workers, analysis scripts, a second editor) can use a
+path's samples or a spectrum without pickling or copying it. The publisher
+hands out a small picklable descriptor and attach() maps the same memory:
+
+    shared = publish({'freq': freq, 'c': c}, meta={'key': key})
+    ...                                  # send shared.descriptor anywhere
+    other = attach(descriptor)           # other.arrays['c'] is a view
+    other.close()
+    shared.unlink()                      # the publisher frees the block
+
+The descriptor lists (name, dtype, shape, offset) of every array; each
+array starts on an ALIGN byte boundary.
+"""
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+ALIGN = 64
+
+class SharedArrays:
+    def __init__(self, shm, descriptor):
+        self.shm = shm
+        self.descriptor = descriptor
+        self.meta = descriptor['meta']
+        self.arrays = {name: np.ndarray(shape, dtype=dtype, buffer=shm.buf,
+                                        offset=offset)
+                       for name, dtype, shape, offset in descriptor['fields']}
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        # views into the block must be gone before it can be unmapped
+        self.arrays = { }
+        self.shm.close()
+
+    def unlink(self):
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError: # already removed by an attached process
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def tracker_pid():
+    # the resource tracker this process registers shared memory with; forked
+    # workers share their parent's, and spawned ones inherit it without
+    # knowing its pid (None)
+    return getattr(resource_tracker._resource_tracker, '_pid', None)
+
+def layout(arrays):
+    # (fields, total size) with every array aligned to ALIGN bytes
+    fields, size = [], 0
+    for name, array in arrays.items():
+        fields.append((name, array.dtype.str, array.shape, size))
+        size += -(-array.nbytes//ALIGN)*ALIGN
+    return fields, max(size, 1)
+
+def publish(arrays, meta=None, name=None):
+    # copy arrays into a new shared block; the caller owns it and should
+    # unlink() it once every reader is done
+    arrays = {key: np.ascontiguousarray(value)
+              for key, value in arrays.items()}
+    fields, size = layout(arrays)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    shared = SharedArrays(shm, {'name': shm.name, 'fields': fields,
+                                'meta': dict(meta or { }),
+                                'tracker': tracker_pid()})
+    for key, value in arrays.items():
+        shared.arrays[key][...] = value
+    return shared
+
+def attach(descriptor, readonly=True):
+    # views of a published block; close() when done, the publisher unlinks
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor['name'], track=False)
+    except TypeError: # python < 3.13 tracks every attach
+        shm = shared_memory.SharedMemory(name=descriptor['name'])
+        # a process with its own tracker would unlink the block at exit
+        pid = tracker_pid()
+        if pid is not None and pid != descriptor.get('tracker'):
+            resource_tracker.unregister(shm._name, 'shared_memory')
+    shared = SharedArrays(shm, descriptor)
+    if readonly:
+        for array in shared.arrays.values():
+            array.flags.writeable = False
+    return shared